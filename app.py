@@ -13,28 +13,44 @@
 # limitations under the License.
 
 import logging
-from os import mkdir
-from os.path import exists, isdir
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from logging.handlers import MemoryHandler
+from os.path import exists
 from pathlib import Path
 
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-from data_measurements import dataset_statistics, dataset_utils
+from data_measurements import dataset_utils
 from data_measurements import streamlit_utils as st_utils
 
-logs = logging.getLogger(__name__)
-logs.setLevel(logging.WARNING)
-logs.propagate = False
 
-if not logs.handlers:
+@st.cache_resource(show_spinner=False)
+def _init_logging():
+    """
+    Sets up the app logger. Streamlit runs this script again on every
+    interaction, so this is cached to only run once per process.
+    """
+    logs = logging.getLogger(__name__)
+    logs.setLevel(logging.WARNING)
+    logs.propagate = False
 
-    Path('./log_files').mkdir(exist_ok=True)
+    if logs.handlers:
+        return logs
+
+    Path("./log_files").mkdir(exist_ok=True)
 
     # Logging info to log file
     file = logging.FileHandler("./log_files/app.log")
     fileformat = logging.Formatter("%(asctime)s:%(message)s")
     file.setLevel(logging.INFO)
     file.setFormatter(fileformat)
+    # Buffer the file writes; flushed at the end of each run of main (see
+    # _flush_logs) or right away on errors.
+    buffered_file = MemoryHandler(capacity=64, flushLevel=logging.ERROR, target=file)
+    buffered_file.setLevel(logging.INFO)
 
     # Logging debug messages to stream
     stream = logging.StreamHandler()
@@ -42,8 +58,27 @@ if not logs.handlers:
     stream.setLevel(logging.WARNING)
     stream.setFormatter(streamformat)
 
-    logs.addHandler(file)
+    logs.addHandler(buffered_file)
     logs.addHandler(stream)
+    return logs
+
+
+logs = _init_logging()
+
+
+@st.cache_resource(show_spinner=False)
+def _init_cache_dir(cache_dir):
+    """
+    Creates the cache directory. Cached like _init_logging, so it only runs
+    once per process rather than on every rerun.
+    """
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+
+def _flush_logs():
+    for handler in logs.handlers:
+        handler.flush()
+
 
 st.set_page_config(
     page_title="Demo to showcase dataset metrics",
@@ -65,6 +100,7 @@ colors = [
 ]
 
 CACHE_DIR = dataset_utils.CACHE_DIR
+_init_cache_dir(CACHE_DIR)
 # String names we are using (not coming from the stored dataset).
 OUR_TEXT_FIELD = dataset_utils.OUR_TEXT_FIELD
 OUR_LABEL_FIELD = dataset_utils.OUR_LABEL_FIELD
@@ -74,84 +110,113 @@ LENGTH_FIELD = dataset_utils.LENGTH_FIELD
 # TODO: Allow users to specify this.
 _MIN_VOCAB_COUNT = 10
 _SHOW_TOP_N_WORDS = 10
+# Bounds for the caches holding whole dstats objects: drop them after an
+# hour and keep at most this many datasets in memory.
+_DSTATS_CACHE_TTL = 3600
+_DSTATS_CACHE_MAX_ENTRIES = 8
 
 
-@st.cache(
-    hash_funcs={
-        dataset_statistics.DatasetStatisticsCacheClass: lambda dstats: dstats.cache_path
-    },
-    allow_output_mutation=True,
-)
-def load_or_prepare(ds_args, show_embeddings, use_cache=False):
+@st.cache_resource(show_spinner=False)
+def _get_stage_executor():
     """
-    Takes the dataset arguments from the GUI and uses them to load a dataset from the Hub or, if
-    a cache for those arguments is available, to load it from the cache.
-    Args:
-        ds_args (dict): the dataset arguments defined via the streamlit app GUI
-        show_embeddings (Bool): whether embeddings should we loaded and displayed for this dataset
-        use_cache (Bool) : whether the cache is used by default or not
-    Returns:
-        dstats: the computed dataset statistics (from the dataset_statistics class)
+    Thread pool shared across reruns for the heavy stages (nPMI, Zipf,
+    embeddings), so the top of the page can render while they run.
     """
-    if not isdir(CACHE_DIR):
-        logs.warning("Creating cache")
-        # We need to preprocess everything.
-        # This should eventually all go into a prepare_dataset CLI
-        mkdir(CACHE_DIR)
-    if use_cache:
-        logs.warning("Using cache")
-    dstats = dataset_statistics.DatasetStatisticsCacheClass(CACHE_DIR, **ds_args, use_cache=use_cache)
-    logs.warning("Loading dataset")
-    dstats.load_or_prepare_dataset()
-    logs.warning("Loading labels")
-    dstats.load_or_prepare_labels()
-    logs.warning("Loading text lengths")
-    dstats.load_or_prepare_text_lengths()
-    logs.warning("Loading duplicates")
-    dstats.load_or_prepare_text_duplicates()
-    logs.warning("Loading perplexities")
-    dstats.load_or_prepare_text_perplexities()
-    logs.warning("Loading vocabulary")
-    dstats.load_or_prepare_vocab()
-    logs.warning("Loading general statistics...")
-    dstats.load_or_prepare_general_stats()
-    if show_embeddings:
-        logs.warning("Loading Embeddings")
-        dstats.load_or_prepare_embeddings()
-    logs.warning("Loading nPMI")
+    return ThreadPoolExecutor(max_workers=4)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_stage_lock():
+    """Guards starting a stage that more than one session may ask for."""
+    return threading.Lock()
+
+
+def _run_stage(load_or_prepare_stage, missing_msg):
     try:
-        dstats.load_or_prepare_npmi()
+        load_or_prepare_stage()
     except:
-        logs.warning("Missing a cache for npmi")
-    logs.warning("Loading Zipf")
-    dstats.load_or_prepare_zipf()
-    return dstats
-
-@st.cache(
-    hash_funcs={
-        dataset_statistics.DatasetStatisticsCacheClass: lambda dstats: dstats.cache_path
-    },
-    allow_output_mutation=True,
+        logs.warning(missing_msg)
+
+
+def _prepare_widget_embeddings(dstats):
+    """
+    Starts loading the embeddings in the background the first time they
+    are shown for this dstats, so toggling them doesn't rebuild dstats.
+    """
+    with _get_stage_lock():
+        if "embeddings" not in dstats.stage_futures:
+            dstats.stage_futures["embeddings"] = _get_stage_executor().submit(
+                _run_stage,
+                dstats.load_or_prepare_embeddings,
+                "Missing a cache for embeddings",
+            )
+
+
+def _wait_for_stage(dstats, stage):
+    """Blocks until a stage submitted to the stage executor has finished."""
+    future = getattr(dstats, "stage_futures", {}).get(stage)
+    if future is not None:
+        future.result()
+
+
+def _set_title_suffix(dstats):
+    """
+    Builds the column title once per prepared dstats, rather than on every
+    render of show_column.
+    """
+    dstats.title_suffix = f"{dstats.dset_name} - {dstats.dset_config} - {dstats.split_name} - {'-'.join(dstats.text_field)}"
+
+
+def _widgets_cache_key(ds_args):
+    """
+    The dataset arguments that identify a cache (as in the cache directory
+    name); the label field and names follow from the dataset and config.
+    """
+    return (
+        ds_args["dset_name"],
+        ds_args["dset_config"],
+        ds_args["split_name"],
+        ds_args["text_field"],
+    )
+
+
+@st.cache_resource(
+    ttl=_DSTATS_CACHE_TTL,
+    max_entries=_DSTATS_CACHE_MAX_ENTRIES,
+    show_spinner=False,
 )
-def load_or_prepare_widgets(ds_args, show_embeddings, use_cache=False):
+def load_or_prepare_widgets(
+    dset_name,
+    dset_config,
+    split_name,
+    text_field,
+    _ds_args,
+    use_cache=False,
+):
     """
     Loader specifically for the widgets used in the app.
+    Only the hashable arguments make up the cache key; the leading
+    underscore keeps streamlit from hashing the full _ds_args dict.
     Args:
-        ds_args:
-        show_embeddings:
+        dset_name, dset_config, split_name, text_field: the cache key, see _widgets_cache_key
+        _ds_args:
         use_cache:
 
     Returns:
 
     """
+    # dataset_statistics pulls in torch, transformers, sklearn and plotly,
+    # and loads the perplexity metric and nltk stopwords on import.
+    from data_measurements import dataset_statistics
 
     if use_cache:
         logs.warning("Using cache")
     if True:
     #try:
-        dstats = dataset_statistics.DatasetStatisticsCacheClass(CACHE_DIR, **ds_args, use_cache=use_cache)
+        dstats = dataset_statistics.DatasetStatisticsCacheClass(CACHE_DIR, **_ds_args, use_cache=use_cache)
         # Don't recalculate; we're live
         dstats.set_deployment(True)
+        _set_title_suffix(dstats)
         # checks whether the cache_dir exists in deployment mode
         # creates cache_dir if not and if in development mode
         cache_dir_exists = dstats.check_cache_dir()
@@ -168,11 +233,21 @@ def load_or_prepare_widgets(ds_args, show_embeddings, use_cache=False):
             dstats.load_or_prepare_dset_peek()
         except:
             logs.warning("Missing a cache for dset peek")
-        try:
-            # General stats widget
-            dstats.load_or_prepare_general_stats()
-        except:
-            logs.warning("Missing a cache for general stats")
+        # The CLI bundles the general, text length and Zipf statistics
+        # in a single file; with it, only their figures are left to load.
+        has_summary_stats = False
+        if use_cache and exists(dstats.summary_stats_json_fid):
+            try:
+                dstats.load_summary_stats()
+                has_summary_stats = True
+            except:
+                logs.warning("Could not read the summary stats")
+        if not has_summary_stats:
+            try:
+                # General stats widget
+                dstats.load_or_prepare_general_stats()
+            except:
+                logs.warning("Missing a cache for general stats")
         try:
             # Labels widget
             dstats.load_or_prepare_labels()
@@ -180,15 +255,9 @@ def load_or_prepare_widgets(ds_args, show_embeddings, use_cache=False):
             logs.warning("Missing a cache for prepare labels")
         try:
             # Text lengths widget
-            dstats.load_or_prepare_text_lengths()
+            dstats.load_or_prepare_text_lengths(with_stats=not has_summary_stats)
         except:
             logs.warning("Missing a cache for text lengths")
-        if show_embeddings:
-            try:
-                # Embeddings widget
-                dstats.load_or_prepare_embeddings()
-            except:
-                logs.warning("Missing a cache for embeddings")
         try:
             dstats.load_or_prepare_text_duplicates()
         except:
@@ -197,14 +266,18 @@ def load_or_prepare_widgets(ds_args, show_embeddings, use_cache=False):
             dstats.load_or_prepare_text_perplexities()
         except:
             logs.warning("Missing a cache for text perplexities")
-        try:
-            dstats.load_or_prepare_npmi()
-        except:
-            logs.warning("Missing a cache for npmi")
-        try:
-            dstats.load_or_prepare_zipf()
-        except:
-            logs.warning("Missing a cache for zipf")
+        # The Zipf widget is further down the page; load it in the
+        # background while the rest renders. Embeddings are only loaded
+        # once they are shown, see _prepare_widget_embeddings, and nPMI
+        # once the user asks for it, see show_column.
+        executor = _get_stage_executor()
+        dstats.stage_futures = {
+            "zipf": executor.submit(
+                _run_stage,
+                partial(dstats.load_or_prepare_zipf, with_stats=not has_summary_stats),
+                "Missing a cache for zipf",
+            ),
+        }
     return dstats, cache_dir_exists
 
 def show_column(dstats, ds_name_to_dict, show_embeddings, column_id):
@@ -217,10 +290,11 @@ def show_column(dstats, ds_name_to_dict, show_embeddings, column_id):
     Returns:
         The function displays the information using the functions defined in the st_utils class.
     """
+    if show_embeddings:
+        _prepare_widget_embeddings(dstats)
     # Note that at this point we assume we can use cache; default value is True.
     # start showing stuff
-    title_str = f"### Showing{column_id}: {dstats.dset_name} - {dstats.dset_config} - {dstats.split_name} - {'-'.join(dstats.text_field)}"
-    st.markdown(title_str)
+    st.markdown(f"### Showing{column_id}: {dstats.title_suffix}")
     logs.info("showing header")
     st_utils.expander_header(dstats, ds_name_to_dict, column_id)
     logs.info("showing general stats")
@@ -230,11 +304,20 @@ def show_column(dstats, ds_name_to_dict, show_embeddings, column_id):
     st_utils.expander_text_duplicates(dstats, column_id)
     st_utils.expander_text_perplexities(dstats, column_id)
     # Uses an interaction; handled a bit differently than other widgets.
-    logs.info("showing npmi widget")
-    st_utils.npmi_widget(dstats.npmi_stats, _MIN_VOCAB_COUNT, column_id)
+    # Finding the available nPMI terms is costly, so only do it on demand.
+    if st.checkbox(f"Show nPMI{column_id}", key=f"npmi_{column_id}"):
+        logs.info("showing npmi widget")
+        if dstats.npmi_stats is None:
+            _run_stage(dstats.load_or_prepare_npmi, "Missing a cache for npmi")
+        if dstats.npmi_stats is not None:
+            st_utils.npmi_widget(dstats.npmi_stats, _MIN_VOCAB_COUNT, column_id)
+        else:
+            st.markdown("nPMI has not been computed yet for this dataset.")
     logs.info("showing zipf")
+    _wait_for_stage(dstats, "zipf")
     st_utils.expander_zipf(dstats.z, dstats.zipf_fig, column_id)
     if show_embeddings:
+        _wait_for_stage(dstats, "embeddings")
         st_utils.expander_text_embeddings(
             dstats.text_dset,
             dstats.fig_tree,
@@ -247,50 +330,75 @@ def show_column(dstats, ds_name_to_dict, show_embeddings, column_id):
 
 def main():
     """ Sidebar description and selection """
-    ds_name_to_dict = dataset_utils.get_dataset_info_dicts()
-    st.title("Data Measurements Tool")
-    # Get the sidebar details
-    st_utils.sidebar_header()
-    # Set up naming, configs, and cache path.
-    compare_mode = st.sidebar.checkbox("Comparison mode")
-
-    # When not doing new development, use the cache.
-    use_cache = True
-    show_embeddings = st.sidebar.checkbox("Show text clusters")
-    # List of datasets for which embeddings are hard to compute:
-
-    if compare_mode:
-        logs.warning("Using Comparison Mode")
-        dataset_args_left = st_utils.sidebar_selection(ds_name_to_dict, " A")
-        dataset_args_right = st_utils.sidebar_selection(ds_name_to_dict, " B")
-        left_col, _, right_col = st.columns([10, 1, 10])
-        dstats_left, cache_exists_left = load_or_prepare_widgets(
-            dataset_args_left, show_embeddings, use_cache=use_cache
-        )
-        with left_col:
-            if cache_exists_left:
-                show_column(dstats_left, ds_name_to_dict, show_embeddings, " A")
-            else:
-                st.markdown("### Missing pre-computed data measures!")
-                st.write(dataset_args_left)
-        dstats_right, cache_exists_right = load_or_prepare_widgets(
-            dataset_args_right, show_embeddings, use_cache=use_cache
-        )
-        with right_col:
-            if cache_exists_right:
-                show_column(dstats_right, ds_name_to_dict, show_embeddings, " B")
+    try:
+        ds_name_to_dict = dataset_utils.get_dataset_info_dicts()
+        st.title("Data Measurements Tool")
+        # Get the sidebar details
+        st_utils.sidebar_header()
+        # Set up naming, configs, and cache path.
+        compare_mode = st.sidebar.checkbox("Comparison mode")
+
+        # When not doing new development, use the cache.
+        use_cache = True
+        show_embeddings = st.sidebar.checkbox("Show text clusters")
+        # List of datasets for which embeddings are hard to compute:
+
+        if compare_mode:
+            logs.warning("Using Comparison Mode")
+            dataset_args_left = st_utils.sidebar_selection(ds_name_to_dict, " A")
+            dataset_args_right = st_utils.sidebar_selection(ds_name_to_dict, " B")
+            left_col, _, right_col = st.columns([10, 1, 10])
+            # The two sides are independent, so prepare them at the same time.
+            # The worker threads need the script context to use st.cache_resource;
+            # the spinner is shown from the script thread.
+            with st.spinner("Loading dataset stats…"), ThreadPoolExecutor(
+                max_workers=2,
+                initializer=add_script_run_ctx,
+                initargs=(None, get_script_run_ctx()),
+            ) as executor:
+                future_left = executor.submit(
+                    load_or_prepare_widgets,
+                    *_widgets_cache_key(dataset_args_left),
+                    dataset_args_left,
+                    use_cache=use_cache,
+                )
+                future_right = executor.submit(
+                    load_or_prepare_widgets,
+                    *_widgets_cache_key(dataset_args_right),
+                    dataset_args_right,
+                    use_cache=use_cache,
+                )
+                dstats_left, cache_exists_left = future_left.result()
+                dstats_right, cache_exists_right = future_right.result()
+            with left_col:
+                if cache_exists_left:
+                    show_column(dstats_left, ds_name_to_dict, show_embeddings, " A")
+                else:
+                    st.markdown("### Missing pre-computed data measures!")
+                    st.write(dataset_args_left)
+            with right_col:
+                if cache_exists_right:
+                    show_column(dstats_right, ds_name_to_dict, show_embeddings, " B")
+                else:
+                    st.markdown("### Missing pre-computed data measures!")
+                    st.write(dataset_args_right)
+        else:
+            logs.warning("Using Single Dataset Mode")
+            dataset_args = st_utils.sidebar_selection(ds_name_to_dict, "")
+            with st.spinner("Loading dataset stats…"):
+                dstats, cache_exists = load_or_prepare_widgets(
+                    *_widgets_cache_key(dataset_args),
+                    dataset_args,
+                    use_cache=use_cache,
+                )
+            if cache_exists:
+                show_column(dstats, ds_name_to_dict, show_embeddings, "")
             else:
                 st.markdown("### Missing pre-computed data measures!")
-                st.write(dataset_args_right)
-    else:
-        logs.warning("Using Single Dataset Mode")
-        dataset_args = st_utils.sidebar_selection(ds_name_to_dict, "")
-        dstats, cache_exists = load_or_prepare_widgets(dataset_args, show_embeddings, use_cache=use_cache)
-        if cache_exists:
-            show_column(dstats, ds_name_to_dict, show_embeddings, "")
-        else:
-            st.markdown("### Missing pre-computed data measures!")
-            st.write(dataset_args)
+                st.write(dataset_args)
+    finally:
+        # Also reached when the run stops early, e.g. on an exception.
+        _flush_logs()
 
 
 if __name__ == "__main__":
@@ -143,7 +143,7 @@ _TREE_DEPTH = 12
 _TREE_MIN_NODES = 250
 # as long as we're using sklearn - already pushing the resources
 _MAX_CLUSTER_EXAMPLES = 5000
-_NUM_VOCAB_BATCHES = 2000
+_TOKENIZATION_BATCH_SIZE = 1000
 _TOP_N = 100
 _CVEC = CountVectorizer(token_pattern="(?u)\\b\\w+\\b", lowercase=True)
 
@@ -163,9 +163,14 @@ class DatasetStatisticsCacheClass:
         label_names,
         calculation=None,
         use_cache=False,
+        num_proc=None,
+        batch_size=_TOKENIZATION_BATCH_SIZE,
     ):
         # This is only used for standalone runs for each kind of measurement.
         self.calculation = calculation
+        # Number of processes and examples per batch used for tokenization
+        self.num_proc = num_proc
+        self.batch_size = batch_size
         self.our_text_field = OUR_TEXT_FIELD
         self.our_length_field = LENGTH_FIELD
         self.our_label_field = OUR_LABEL_FIELD
@@ -226,6 +231,9 @@ class DatasetStatisticsCacheClass:
         self.std_length = None
         self.general_stats_dict = None
         self.num_uniq_lengths = 0
+        self.length_stats_dict = None
+        # Length stats, general stats, top vocab and Zipf fit in one dict
+        self.summary_stats_dict = None
         # clustering text by embeddings
         # the hierarchical clustering tree is represented as a list of nodes,
         # the first is the root
@@ -310,6 +318,10 @@ class DatasetStatisticsCacheClass:
         # Needed for UI
         self.zipf_fig_fid = pjoin(self.cache_path, "zipf_fig.json")
 
+        ## Summary of the small statistics, precomputed by the CLI
+        # Needed for UI
+        self.summary_stats_json_fid = pjoin(self.cache_path, "stats.json")
+
         ## Embeddings cache files
         # Needed for UI
         self.node_list_fid = pjoin(self.cache_path, "node_list.th")
@@ -382,13 +394,15 @@ class DatasetStatisticsCacheClass:
                     write_df(self.perplexities_df, self.perplexities_df_fid)
                     write_json(self.general_stats_dict, self.general_stats_json_fid)
 
-    def load_or_prepare_text_lengths(self, save=True):
+    def load_or_prepare_text_lengths(self, save=True, with_stats=True):
         """
         The text length widget relies on this function, which provides
         a figure of the text lengths, some text length statistics, and
         a text length dataframe to peruse.
         Args:
             save:
+            with_stats: Also load the text length statistics; not needed
+                when they were read from the summary stats.
         Returns:
 
         """
@@ -402,7 +416,7 @@ class DatasetStatisticsCacheClass:
                     self.fig_tok_length.savefig(self.fig_tok_length_fid)
         # Text length dataframe
         if self.use_cache and exists(self.length_df_fid):
-            self.length_df = feather.read_feather(self.length_df_fid)
+            self.length_df = read_df(self.length_df_fid)
         else:
             if not self.live:
                 self.prepare_length_df()
@@ -410,6 +424,8 @@ class DatasetStatisticsCacheClass:
                     write_df(self.length_df, self.length_df_fid)
 
         # Text length stats.
+        if not with_stats:
+            return
         if self.use_cache and exists(self.length_stats_json_fid):
             with open(self.length_stats_json_fid, "r") as f:
                 self.length_stats_dict = json.load(f)
@@ -501,15 +517,13 @@ class DatasetStatisticsCacheClass:
         logs.info(self.vocab_counts_filtered_df)
 
     def load_vocab(self):
-        with open(self.vocab_counts_df_fid, "rb") as f:
-            self.vocab_counts_df = feather.read_feather(f)
+        self.vocab_counts_df = read_df(self.vocab_counts_df_fid)
         # Handling for changes in how the index is saved.
         self.vocab_counts_df = self._set_idx_col_names(self.vocab_counts_df)
 
     def load_or_prepare_text_duplicates(self, save=True):
         if self.use_cache and exists(self.dup_counts_df_fid):
-            with open(self.dup_counts_df_fid, "rb") as f:
-                self.dup_counts_df = feather.read_feather(f)
+            self.dup_counts_df = read_df(self.dup_counts_df_fid)
         elif self.dup_counts_df is None:
             if not self.live:
                 self.prepare_text_duplicates()
@@ -525,8 +539,7 @@ class DatasetStatisticsCacheClass:
 
     def load_or_prepare_text_perplexities(self, save=True):
         if self.use_cache and exists(self.perplexities_df_fid):
-            with open(self.perplexities_df_fid, "rb") as f:
-                self.perplexities_df = feather.read_feather(f)
+            self.perplexities_df = read_df(self.perplexities_df_fid)
         elif self.perplexities_df is None:
             if not self.live:
                 self.prepare_text_perplexities()
@@ -541,8 +554,7 @@ class DatasetStatisticsCacheClass:
         self.general_stats_dict = json.load(
             open(self.general_stats_json_fid, encoding="utf-8")
         )
-        with open(self.sorted_top_vocab_df_fid, "rb") as f:
-            self.sorted_top_vocab_df = feather.read_feather(f)
+        self.sorted_top_vocab_df = read_df(self.sorted_top_vocab_df_fid)
         self.text_nan_count = self.general_stats_dict[TEXT_NAN_CNT]
         self.dedup_total = self.general_stats_dict[DEDUP_TOT]
         self.total_words = self.general_stats_dict[TOT_WORDS]
@@ -626,7 +638,7 @@ class DatasetStatisticsCacheClass:
 
     def load_or_prepare_tokenized_df(self, save=True):
         if self.use_cache and exists(self.tokenized_df_fid):
-            self.tokenized_df = feather.read_feather(self.tokenized_df_fid)
+            self.tokenized_df = read_df(self.tokenized_df_fid)
         else:
             if not self.live:
                 # tokenize all text instances
@@ -686,6 +698,8 @@ class DatasetStatisticsCacheClass:
         tokenized_dset = self.text_dset.map(
             tokenize_batch,
             batched=True,
+            batch_size=self.batch_size,
+            num_proc=self.num_proc,
             # remove_columns=[OUR_TEXT_FIELD], keep around to print
         )
         tokenized_df = pd.DataFrame(tokenized_dset)
@@ -743,14 +757,20 @@ class DatasetStatisticsCacheClass:
             )
 
     def load_or_prepare_npmi(self):
-        self.npmi_stats = nPMIStatisticsCacheClass(self, use_cache=self.use_cache)
-        self.npmi_stats.load_or_prepare_npmi_terms()
+        # Only set npmi_stats once its terms are there, so that a failed
+        # attempt leaves it unset.
+        npmi_stats = nPMIStatisticsCacheClass(self, use_cache=self.use_cache)
+        npmi_stats.load_or_prepare_npmi_terms()
+        self.npmi_stats = npmi_stats
 
-    def load_or_prepare_zipf(self, save=True):
+    def load_or_prepare_zipf(self, save=True, with_stats=True):
         # TODO: Current UI only uses the fig, meaning the self.z here is irrelevant
         # when only reading from cache. Either the UI should use it, or it should
         # be removed when reading in cache
-        if self.use_cache and exists(self.zipf_fig_fid) and exists(self.zipf_fid):
+        # Without with_stats, self.z is expected to come from the summary stats.
+        if self.use_cache and not with_stats and exists(self.zipf_fig_fid):
+            self.zipf_fig = read_plotly(self.zipf_fig_fid)
+        elif self.use_cache and exists(self.zipf_fig_fid) and exists(self.zipf_fid):
             with open(self.zipf_fid, "r") as f:
                 zipf_dict = json.load(f)
             self.z = Zipf()
@@ -772,6 +792,67 @@ class DatasetStatisticsCacheClass:
                 write_zipf_data(self.z, self.zipf_fid)
                 write_plotly(self.zipf_fig, self.zipf_fig_fid)
 
+    def load_or_prepare_summary_stats(self, save=True):
+        """
+        Gathers the small statistics shown in the UI (text length statistics,
+        general statistics, top vocabulary and Zipf fit) in a single file, so
+        the app can read them in one go instead of preparing each of them.
+        Meant to be run by the CLI after the other measurements.
+        Args:
+            save: Store the summary to disk.
+        Returns:
+
+        """
+        if self.use_cache and exists(self.summary_stats_json_fid):
+            logs.info("Loading cached summary stats")
+            self.load_summary_stats()
+        else:
+            if not self.live:
+                logs.info("Preparing summary stats")
+                self.prepare_summary_stats()
+                if save:
+                    write_json(self.summary_stats_dict, self.summary_stats_json_fid)
+
+    def load_summary_stats(self):
+        with open(self.summary_stats_json_fid, "r", encoding="utf-8") as f:
+            self.summary_stats_dict = json.load(f)
+        self.length_stats_dict = self.summary_stats_dict["length stats"]
+        self.avg_length = self.length_stats_dict["avg length"]
+        self.std_length = self.length_stats_dict["std length"]
+        self.num_uniq_lengths = self.length_stats_dict["num lengths"]
+        self.general_stats_dict = self.summary_stats_dict["general stats"]
+        self.text_nan_count = self.general_stats_dict[TEXT_NAN_CNT]
+        self.dedup_total = self.general_stats_dict[DEDUP_TOT]
+        self.total_words = self.general_stats_dict[TOT_WORDS]
+        self.total_open_words = self.general_stats_dict[TOT_OPEN_WORDS]
+        self.sorted_top_vocab_df = pd.DataFrame(**self.summary_stats_dict["top vocab"])
+        # orient="split" leaves out the index name, so it is stored separately.
+        self.sorted_top_vocab_df.index.name = self.summary_stats_dict.get(
+            "top vocab index"
+        )
+        self.z = Zipf()
+        self.z.load(self.summary_stats_dict["zipf"])
+
+    def prepare_summary_stats(self):
+        if not self.live:
+            if self.length_stats_dict is None:
+                self.load_or_prepare_text_lengths()
+            if self.general_stats_dict is None:
+                self.load_or_prepare_general_stats()
+            if self.z is None:
+                if self.vocab_counts_df is None:
+                    self.load_or_prepare_vocab()
+                self.load_or_prepare_zipf()
+            self.summary_stats_dict = {
+                "length stats": self.length_stats_dict,
+                "general stats": self.general_stats_dict,
+                "top vocab": json.loads(
+                    self.sorted_top_vocab_df.to_json(orient="split")
+                ),
+                "top vocab index": self.sorted_top_vocab_df.index.name,
+                "zipf": make_zipf_dict(self.z),
+            }
+
     def _set_idx_col_names(self, input_vocab_df):
         if input_vocab_df.index.name != VOCAB and VOCAB in input_vocab_df.columns:
             input_vocab_df = input_vocab_df.set_index([VOCAB])
@@ -1027,44 +1108,22 @@ class nPMIStatisticsCacheClass:
         return self.load_or_prepare_npmi_terms()
 
 
-def dummy(doc):
-    return doc
-
-
 def count_vocab_frequencies(tokenized_df):
     """
-    Based on an input pandas DataFrame with a 'text' column,
+    Based on an input pandas DataFrame with a 'tokenized_text' column,
     this function will count the occurrences of all words.
-    :return: [num_words x num_sentences] DataFrame with the rows corresponding to the
-    different vocabulary words and the column to the presence (0 or 1) of that word.
+    :return: [num_words x 1] DataFrame with the rows corresponding to the
+    different vocabulary words (sorted alphabetically) and their counts.
     """
-
-    cvec = CountVectorizer(
-        tokenizer=dummy,
-        preprocessor=dummy,
-    )
-    # We do this to calculate per-word statistics
+    # Flatten all of the tokenized sentences and map each word to an id.
+    logs.info("Mapping the previous tokenization to word ids")
+    tokens = tokenized_df[TOKENIZED_FIELD].explode().dropna()
+    token_ids, vocab = pd.factorize(tokens, sort=True)
     # Fast calculation of single word counts
-    logs.info(
-        "Fitting dummy tokenization to make matrix using the previous tokenization"
-    )
-    cvec.fit(tokenized_df[TOKENIZED_FIELD])
-    document_matrix = cvec.transform(tokenized_df[TOKENIZED_FIELD])
-    batches = np.linspace(0, tokenized_df.shape[0], _NUM_VOCAB_BATCHES).astype(int)
-    i = 0
-    tf = []
-    while i < len(batches) - 1:
-        logs.info("%s of %s vocab batches" % (str(i), str(len(batches))))
-        batch_result = np.sum(
-            document_matrix[batches[i] : batches[i + 1]].toarray(), axis=0
-        )
-        tf.append(batch_result)
-        i += 1
-    word_count_df = pd.DataFrame(
-        [np.sum(tf, axis=0)], columns=cvec.get_feature_names()
-    ).transpose()
+    logs.info("Counting %s words" % len(token_ids))
+    word_counts = np.bincount(token_ids, minlength=len(vocab))
     # Now organize everything into the dataframes
-    word_count_df.columns = [CNT]
+    word_count_df = pd.DataFrame({CNT: word_counts}, index=vocab)
     word_count_df.index.name = WORD
     return word_count_df
 
@@ -1231,9 +1290,15 @@ def intersect_dfs(df_dict):
 
 
 def write_df(df, df_fid):
+    # Keeps feather's default lz4 compression: the CLI pushes these files
+    # to the Hub, and the string columns are copied out on read anyway.
     feather.write_feather(df, df_fid)
 
 
+def read_df(df_fid):
+    return feather.read_feather(df_fid, memory_map=True)
+
+
 def write_json(json_dict, json_fid):
     with open(json_fid, "w", encoding="utf-8") as f:
         json.dump(json_dict, f)
@@ -1259,14 +1324,22 @@ def write_subgroup_npmi_data(subgroup, subgroup_dict, subgroup_files):
         subgroup_cooc_df.to_csv(f)
 
 
-def write_zipf_data(z, zipf_fid):
+def make_zipf_dict(z):
     zipf_dict = {}
     zipf_dict["xmin"] = int(z.xmin)
     zipf_dict["xmax"] = int(z.xmax)
     zipf_dict["alpha"] = float(z.alpha)
     zipf_dict["ks_distance"] = float(z.distance)
-    zipf_dict["p-value"] = float(z.ks_test.pvalue)
+    # A Zipf object loaded from cache only has the p-value, not the KS test.
+    zipf_dict["p-value"] = float(
+        z.ks_test.pvalue if z.ks_test is not None else z.get_p()
+    )
     zipf_dict["uniq_counts"] = [int(count) for count in z.uniq_counts]
     zipf_dict["uniq_ranks"] = [int(rank) for rank in z.uniq_ranks]
+    return zipf_dict
+
+
+def write_zipf_data(z, zipf_fid):
+    zipf_dict = make_zipf_dict(z)
     with open(zipf_fid, "w+", encoding="utf-8") as f:
         json.dump(zipf_dict, f)
@@ -248,7 +248,7 @@ def dictionarize_info(dset_info):
     return res
 
 
-@st.cache
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_dataset_info_dicts(dataset_id=None):
     """
     Creates a dict from dataset configs.
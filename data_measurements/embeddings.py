@@ -13,13 +13,15 @@
 # limitations under the License.
 
 import math
+import threading
+from functools import lru_cache
 from os.path import exists
 from os.path import join as pjoin
 
 import plotly.graph_objects as go
 import torch
 import transformers
-from datasets import load_from_disk
+from datasets import Features, Sequence, Value, load_from_disk
 from plotly.io import read_json
 from tqdm import tqdm
 
@@ -39,6 +41,28 @@ def sentence_mean_pooling(model_output, attention_mask):
     )
 
 
+# lru_cache doesn't lock while the first call runs, so two Embeddings
+# created at the same time (e.g. both sides of the app's comparison view)
+# would each load the model.
+_SENTENCE_MODEL_LOCK = threading.Lock()
+
+
+def load_sentence_model(model_name, device):
+    """
+    Loads the sentence embedding tokenizer and model once per process,
+    so they are shared by all of the Embeddings objects.
+    """
+    with _SENTENCE_MODEL_LOCK:
+        return _load_sentence_model(model_name, device)
+
+
+@lru_cache(maxsize=None)
+def _load_sentence_model(model_name, device):
+    tokenizer = transformers.AutoTokenizer.from_pretrained(model_name, use_fast=True)
+    model = transformers.AutoModel.from_pretrained(model_name).to(device)
+    return tokenizer, model
+
+
 class Embeddings:
     def __init__(
         self,
@@ -51,10 +75,7 @@ class Embeddings:
         """Item embeddings and clustering"""
         self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
         self.model_name = "sentence-transformers/all-mpnet-base-v2"
-        self.tokenizer = transformers.AutoTokenizer.from_pretrained(self.model_name)
-        self.model = transformers.AutoModel.from_pretrained(self.model_name).to(
-            self.device
-        )
+        self.tokenizer, self.model = load_sentence_model(self.model_name, self.device)
         self.text_dset = text_dset if dstats is None else dstats.text_dset
         self.text_field_name = (
             text_field_name if dstats is None else dstats.our_text_field
@@ -98,24 +119,27 @@ class Embeddings:
         using the field self.text_field_name as input.
         Returns:
             Dataset: HF dataset object with a single EMBEDDING_FIELD field
-                corresponding to the embeddings (list of floats)
+                corresponding to the embeddings (list of float16)
         """
 
         def batch_embed_sentences(sentences):
             return {
-                EMBEDDING_FIELD: [
-                    embed.tolist()
-                    for embed in self.compute_sentence_embeddings(
-                        sentences[self.text_field_name]
-                    )
-                ]
+                EMBEDDING_FIELD: self.compute_sentence_embeddings(
+                    sentences[self.text_field_name]
+                )
+                .half()
+                .cpu()
+                .numpy()
             }
 
+        # The embeddings are normalized, so storing them as float16 keeps
+        # the dot products used for clustering close while halving the size.
         self.embeddings_dset = self.text_dset.map(
             batch_embed_sentences,
             batched=True,
             batch_size=32,
             remove_columns=[self.text_field_name],
+            features=Features({EMBEDDING_FIELD: Sequence(Value("float16"))}),
         )
 
         return self.embeddings_dset
@@ -138,7 +162,10 @@ class Embeddings:
             self.node_list, self.nid_map = torch.load(self.node_list_fid)
         else:
             self.make_text_embeddings()
-            embeddings = torch.Tensor(self.embeddings_dset[EMBEDDING_FIELD])
+            # Read straight from Arrow; upcast since the clustering runs on CPU.
+            embeddings = self.embeddings_dset.with_format("torch")[
+                EMBEDDING_FIELD
+            ].float()
             self.node_list = fast_cluster(
                 embeddings, batch_size, approx_neighbors, min_cluster_size
             )
@@ -20,7 +20,7 @@ import streamlit as st
 from st_aggrid import AgGrid, GridOptionsBuilder
 
 from .dataset_utils import HF_DESC_FIELD, HF_FEATURE_FIELD, HF_LABEL_FIELD
-st.set_option('deprecation.showPyplotGlobalUse', False)
+
 
 def sidebar_header():
     st.sidebar.markdown(
@@ -191,6 +191,9 @@ def expander_text_lengths(dstats, column_id):
 
 
 ### Third, use a sentence embedding model
+# The heavier widgets are fragments: interacting with one of them only reruns
+# that widget instead of the whole app script.
+@st.fragment
 def expander_text_embeddings(
     text_dset, fig_tree, node_list, embeddings, text_field, column_id
 ):
@@ -350,6 +353,7 @@ def expander_npmi_description(min_vocab):
 
 
 ### Finally, show Zipf stuff
+@st.fragment
 def expander_zipf(z, zipf_fig, column_id):
     with st.expander(
         f"Vocabulary Distribution{column_id}: Zipf's Law Fit", expanded=False
@@ -423,6 +427,7 @@ def expander_zipf(z, zipf_fig, column_id):
 
 
 ### Finally finally finally, show nPMI stuff.
+@st.fragment
 def npmi_widget(npmi_stats, min_vocab, column_id):
     """
     Part of the main app, but uses a user interaction so pulled out as its own f'n.
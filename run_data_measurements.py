@@ -64,6 +64,8 @@ def load_or_prepare_widgets(ds_args, show_embeddings=False, use_cache=False):
     do_npmi(npmi_stats)
     # Zipf widget
     dstats.load_or_prepare_zipf()
+    # Summary of the above, read by the app in one go
+    dstats.load_or_prepare_summary_stats()
 
 
 def load_or_prepare(dataset_args, do_html=False, use_cache=False):
@@ -177,6 +179,7 @@ def get_text_label_df(
     out_dir,
     do_html=False,
     use_cache=True,
+    num_proc=None,
 ):
     if not use_cache:
         print("Not using any cache; starting afresh")
@@ -199,6 +202,7 @@ def get_text_label_df(
         "label_names": label_names,
         "calculation": calculation,
         "cache_dir": out_dir,
+        "num_proc": num_proc,
     }
     load_or_prepare_widgets(dataset_args, use_cache=use_cache)
 
@@ -278,6 +282,13 @@ def main():
         help="Whether to write out corresponding HTML files (Optional)",
     )
     parser.add_argument("--out_dir", default="cache_dir", help="Where to write out to.")
+    parser.add_argument(
+        "--num_proc",
+        type=int,
+        default=None,
+        required=False,
+        help="Number of processes to use for tokenization (Optional)",
+    )
     parser.add_argument(
         "--overwrite_previous",
         default=False,
@@ -326,6 +337,7 @@ def main():
             args.out_dir,
             do_html=args.do_html,
             use_cache=args.cached,
+            num_proc=args.num_proc,
         )
         repo.push_to_hub(commit_message="Added dataset cache.")
 